@@ -1,10 +1,29 @@
 """Object oriented dice manipulation"""
 from __future__ import annotations
-import itertools
 import random
 from collections import Counter
+from functools import lru_cache, reduce
+from operator import mul
 
-from typing import Union, Callable, Tuple
+from typing import Dict, Union, Tuple
+
+import numpy as np
+
+# Biggest count a np.int64 can hold, pools with more outcomes than this
+# fall back to python integers to keep the distribution exact
+INT64_MAX = np.iinfo(np.int64).max
+
+# Pools made of up to COMMON_MAX_DICE of one of those dice keep their
+# distribution in _PRECOMPUTED_DIST once computed, whatever the cache evicts
+COMMON_SIDES = (2, 3, 4, 6, 8, 10, 12, 20)
+COMMON_MAX_DICE = 20
+_PRECOMPUTED_DIST: Dict[Tuple[int, int], tuple] = {}
+
+# Pools whose exact distribution would cost more than DICEPOOL_EXACT_LIMIT
+# operations (number of dice times number of possible results) get an
+# empirical distribution from DICEPOOL_SAMPLES rolls instead
+DICEPOOL_EXACT_LIMIT = 10 ** 7
+DICEPOOL_SAMPLES = 100_000
 
 
 def normalize_rng(value: Union[Dice, range]) -> Tuple[range, int]:
@@ -22,6 +41,119 @@ def normalize_rng(value: Union[Dice, range]) -> Tuple[range, int]:
     return (range(rng.start - mod, rng.stop - mod), mod)
 
 
+def _parse_pool_args(args: tuple) -> Tuple[Tuple[range, ...], int]:
+    """
+    Split dice pool arguments (Dice, range and int objects) into a tuple of
+    normalized ranges and the total modificator.
+
+    """
+    rngs, mod = list(), 0
+    for arg in args:
+        if isinstance(arg, int):
+            mod += arg
+        elif isinstance(arg, (Dice, range)):
+            nrm = normalize_rng(arg)
+            rngs.append(nrm[0])
+            mod += nrm[1]
+    return tuple(rngs), mod
+
+
+def _add_die(pmf: np.ndarray, sides: int) -> np.ndarray:
+    """
+    Return the distribution `pmf` convolved with the one of a dice
+    of _sides_ faces.
+
+    Since every face of a dice has the same weight, each new count is the
+    sum of a sliding window of `sides` counts, computed from the cumulated
+    sums in O(len(pmf)) instead of the O(len(pmf) * sides) of a convolution.
+
+    """
+    result = np.cumsum(np.concatenate((pmf, np.zeros(sides - 1, dtype=pmf.dtype))))
+    result[sides:] -= result[:-sides].copy()
+    return result
+
+
+def _remove_die(pmf: np.ndarray, sides: int) -> np.ndarray:
+    """
+    Return the distribution `pmf` deconvolved from the one of a dice
+    of _sides_ faces, the opposite of `_add_die`.
+
+    Exact integer version of the polynomial division of `pmf` by the dice
+    distribution: since `pmf = result * (1 + x + ... + x**(sides - 1))`,
+    each count is `result[i] = pmf[i] - pmf[i - 1] + result[i - sides]`.
+
+    """
+    result = np.diff(pmf, prepend=pmf.dtype.type(0))[: len(pmf) - sides + 1]
+    for offset in range(sides):
+        result[offset::sides] = np.cumsum(result[offset::sides])
+    return result
+
+
+@lru_cache(maxsize=1024)
+def _build_dist(rngs_key: Tuple[Tuple[int, int], ...], mod: int) -> tuple:
+    """
+    Return the distribution of a dice pool as a tuple of `(value, count)`
+    pairs sorted by value.
+
+    `rngs_key` is the sorted tuple of the `(start, stop)` of each dice range,
+    the result being cached since identical pools share the same distribution.
+
+    """
+    # Convolve the dice distributions one at a time instead of
+    # enumerating every possible combination of results
+    outcomes = reduce(mul, (stop - start for start, stop in rngs_key), 1)
+    dtype = np.int64 if outcomes <= INT64_MAX else object
+    pmf = np.ones(1, dtype=dtype)
+    for start, stop in rngs_key:
+        pmf = _add_die(pmf, stop - start)
+    offset = sum(start for start, _ in rngs_key) + mod
+    return tuple((offset + i, int(chances)) for i, chances in enumerate(pmf) if chances)
+
+
+def _sample_dist(
+    rngs_key: Tuple[Tuple[int, int], ...], mod: int, samples: int
+) -> tuple:
+    """
+    Return an approximated distribution of a dice pool, same format as
+    `_build_dist`, by rolling it _samples_ times.
+
+    """
+    totals = np.full(samples, mod, dtype=np.int64)
+    for start, stop in rngs_key:
+        totals += np.random.randint(start, stop, samples)
+    values, counts = np.unique(totals, return_counts=True)
+    return tuple(zip(values.tolist(), counts.tolist()))
+
+
+def _needs_approx(rngs_key: Tuple[Tuple[int, int], ...]) -> bool:
+    """
+    Return whether the exact distribution of a dice pool would cost more
+    than `DICEPOOL_EXACT_LIMIT` operations, being the number of dice times
+    the number of possible results.
+
+    """
+    results = sum(stop - start - 1 for start, stop in rngs_key) + 1
+    return len(rngs_key) * results > DICEPOOL_EXACT_LIMIT
+
+
+def _pool_dist(rngs_key: Tuple[Tuple[int, int], ...], mod: int) -> tuple:
+    """
+    Return the distribution of a dice pool, same as `_build_dist`, looking
+    first in the precomputed distributions for common pools of identical
+    dice without modificator.
+
+    """
+    sides = {stop - start for start, stop in rngs_key}
+    if mod != 0 or len(sides) != 1:
+        return _build_dist(rngs_key, mod)
+    key = (sides.pop(), len(rngs_key))
+    if key[0] not in COMMON_SIDES or key[1] > COMMON_MAX_DICE:
+        return _build_dist(rngs_key, mod)
+    if key not in _PRECOMPUTED_DIST:
+        _PRECOMPUTED_DIST[key] = _build_dist(rngs_key, mod)
+    return _PRECOMPUTED_DIST[key]
+
+
 class Dice:
     """
     An object representing a dice such as `d6` or `d13`
@@ -42,6 +174,8 @@ class Dice:
     bus is basically the same thing as a `d9 + 3`
     """
 
+    __slots__ = ("rng", "avg", "min", "max", "sides", "_str")
+
     def __init__(self, p1: int, p2: int = None):
         if not isinstance(p1, int) or (p2 is not None and not isinstance(p2, int)):
             raise ValueError("Dice faces should be integer")
@@ -50,21 +184,24 @@ class Dice:
             self.rng = range(1, p1 + 1)
         else:
             self.rng = range(p1, p2 + 1)
-        self.avg = sum(self.rng) / (self.rng.stop - 1)
+        self.avg = (self.rng.start + self.rng.stop - 1) / 2
         self.min = self.rng.start
         self.max = self.rng.stop - 1
         self.sides = self.max
+        self._str = None
 
     def __str__(self):
-        mod = self.rng.start - 1
-        expr = f"d{self.rng.stop - mod - 1}"
-        if mod != 0:
-            if mod > 0:
-                expr += " + "
-            else:
-                expr += " - "
-            expr += str(abs(mod))
-        return expr
+        if self._str is None:
+            mod = self.rng.start - 1
+            expr = f"d{self.rng.stop - mod - 1}"
+            if mod != 0:
+                if mod > 0:
+                    expr += " + "
+                else:
+                    expr += " - "
+                expr += str(abs(mod))
+            self._str = expr
+        return self._str
 
     def __repr__(self):
         return self.__str__()
@@ -108,21 +245,16 @@ class Dice:
     def __rmul__(self, other: int) -> DicePool:
         return self.__mul__(other)
 
-    def _chances(self, threshold: int, comparator: Callable) -> float:
+    def _rate(self, chances_to_pass: int) -> float:
         """
-        Comparator should be a lambda such as `lambda a, b: a > b`
-
-        Return the rate with which this dice compare its possible
-        results with the threshold favorably.
+        Return the rate of `chances_to_pass` faces among the dice faces,
+        once clamped to the actual number of faces.
 
         Result is 1.0 >= rate >= 0.0, multiply it by 100 get percents.
 
         """
         total_chances = self.rng.stop - self.rng.start
-        chances_to_pass = len(
-            result for result in self.rng if comparator(result, threshold)
-        )
-        return chances_to_pass / total_chances
+        return max(0, min(total_chances, chances_to_pass)) / total_chances
 
     def rgt(self, threshold: int) -> float:
         """
@@ -132,7 +264,7 @@ class Dice:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return len(list(filter(lambda i: i > threshold, self.rng))) / self.max
+        return self._rate(self.rng.stop - 1 - threshold)
 
     def rge(self, threshold: int) -> float:
         """
@@ -142,7 +274,7 @@ class Dice:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a >= b)
+        return self._rate(self.rng.stop - threshold)
 
     def rlt(self, threshold: int) -> float:
         """
@@ -152,7 +284,7 @@ class Dice:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a < b)
+        return self._rate(threshold - self.rng.start)
 
     def rle(self, threshold: int) -> float:
         """
@@ -162,7 +294,7 @@ class Dice:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a <= b)
+        return self._rate(threshold - self.rng.start + 1)
 
     def roll(self):
         """
@@ -199,40 +331,105 @@ class DicePool:
         my_dice_pool = DicePool(range(1, 7), range(1, 11), 3, range(1, 13), -5)
     ````
 
+    Pools too big for their exact distribution to be computed in a
+    reasonable time (see `DICEPOOL_EXACT_LIMIT`) get an approximated one,
+    built from `DICEPOOL_SAMPLES` rolls.
+
     """
 
+    __slots__ = (
+        "rngs",
+        "mod",
+        "dist",
+        "min",
+        "max",
+        "range",
+        "_rng_counts",
+        "_starts",
+        "_stops",
+        "_total",
+        "_weighted_sum",
+        "_keys",
+        "_counts",
+        "_cdf",
+        "_str",
+        "_approx",
+    )
+
     def __init__(self, *args):
-        rngs, self.mod = list(), 0
-        for arg in args:
-            if isinstance(arg, int):
-                self.mod += arg
-            elif isinstance(arg, (Dice, range)):
-                nrm = normalize_rng(arg)
-                rngs.append(nrm[0])
-                self.mod += nrm[1]
-        self.rngs = tuple(rngs)
-
-        self.dist = Counter(
-            sum(result) + self.mod for result in itertools.product(*self.rngs)
-        )
-        self.min = next(iter(self.dist))
-        self.max = list(self.dist)[-1]
+        self.rngs, self.mod = _parse_pool_args(args)
+
+        rngs_key = tuple(sorted((rng.start, rng.stop) for rng in self.rngs))
+        self._approx = _needs_approx(rngs_key)
+        if self._approx:
+            self._init_dist(_sample_dist(rngs_key, self.mod, DICEPOOL_SAMPLES))
+        else:
+            self._init_dist(_pool_dist(rngs_key, self.mod))
+
+    @classmethod
+    def _from_dist(
+        cls, rngs: Tuple[range, ...], mod: int, dist: tuple, approx: bool = False
+    ) -> DicePool:
+        """
+        Build a DicePool from already normalized ranges, its modificator and
+        its distribution as `(value, count)` pairs sorted by value,
+        skipping the distribution computation.
+
+        """
+        pool = cls.__new__(cls)
+        pool.rngs, pool.mod, pool._approx = rngs, mod, approx
+        pool._init_dist(dist)
+        return pool
 
-        values = list(self.dist.keys())
-        self.range = range(values[0], values[-1])
+    def _init_dist(self, dist: tuple) -> None:
+        """
+        Set the distribution of this dice pool, given as `(value, count)`
+        pairs sorted by value, and everything derived from it or from
+        its dice.
+
+        """
+        self._rng_counts = Counter((rng.start, rng.stop) for rng in self.rngs)
+        self._starts = np.fromiter((rng.start for rng in self.rngs), np.int64)
+        self._stops = np.fromiter((rng.stop for rng in self.rngs), np.int64)
+        self._str = None
+        self.dist = Counter(dict(dist))
+
+        # Reduce the distribution with numpy rather than python-level passes,
+        # using python integers whenever int64 could overflow
+        self._total = sum(self.dist.values())
+        dtype = np.int64 if self._total <= INT64_MAX else object
+        self._keys = np.fromiter(self.dist.keys(), np.int64, len(self.dist))
+        # np.fromiter only builds object arrays from numpy 1.23 on
+        self._counts = np.array(list(self.dist.values()), dtype=dtype)
+        self._cdf = np.cumsum(self._counts)
+
+        # Taken from the dice bounds, approximated distributions may not
+        # contain the extremes
+        self.min = int(self._starts.sum()) + self.mod
+        self.max = int((self._stops - 1).sum()) + self.mod
+        self.range = range(self.min, self.max + 1)
+        if self._total * max(abs(self.min), abs(self.max)) > INT64_MAX:
+            dtype = object
+        self._weighted_sum = int(
+            np.dot(self._keys.astype(dtype), self._counts.astype(dtype))
+        )
 
     def __str__(self):
-        pool = {}
-        for rng in self.rngs:
-            pool[rng] = pool.get(rng, 0) + 1
-        expr = " + ".join(f"{num}d{rng.stop - 1}" for rng, num in pool.items())
-        if self.mod != 0:
-            if self.mod > 0:
-                expr += " + "
-            else:
-                expr += " - "
-            expr += str(abs(self.mod))
-        return expr
+        if self._str is None:
+            sides, first, nums = np.unique(
+                self._stops - self._starts, return_index=True, return_counts=True
+            )
+            expr = " + ".join(
+                f"{nums[i]}d{sides[i]}" for i in np.argsort(first, kind="stable")
+            )
+            if self.mod != 0:
+                if self.mod > 0:
+                    expr += " + "
+                else:
+                    expr += " - "
+                expr += str(abs(self.mod))
+            self._str = expr
+        return self._str
 
     def __repr__(self):
         return self.__str__()
@@ -254,54 +451,71 @@ class DicePool:
             rng, mod = normalize_rng(other)
             return self.rngs == tuple(rng) and self.mod == mod
         if isinstance(other, DicePool):
-            return self.dist == other.dist and self.mod == other.mod
+            # Same as comparing the distributions, even when approximated
+            return self._rng_counts == other._rng_counts and self.mod == other.mod
         return NotImplemented
 
     def __ne__(self, other: Union[Dice, DicePool]):
         if isinstance(other, Dice):
             return self.rngs != tuple(other.rng)
         if isinstance(other, DicePool):
-            return self.dist != other.dist or self.mod != other.mod
+            return self._rng_counts != other._rng_counts or self.mod != other.mod
         return NotImplemented
 
+    def __hash__(self):
+        return hash((frozenset(self._rng_counts.items()), self.mod))
+
+    def _shift(self, mod: int) -> DicePool:
+        """
+        Return this dice pool with _mod_ added to its modificator, shifting
+        its distribution instead of computing it again. Keeps the samples of
+        approximated pools, so their odds stay the same.
+
+        """
+        dist = tuple(zip((self._keys + mod).tolist(), self._counts.tolist()))
+        return DicePool._from_dist(self.rngs, self.mod + mod, dist, self._approx)
+
     def __add__(self, other: Union[DicePool, Dice, int]) -> DicePool:
         if isinstance(other, int):
-            return DicePool(*self.rngs, self.mod + other)
+            return self._shift(other)
         if isinstance(other, Dice):
             return DicePool(*self.rngs, other.rng, self.mod)
         return DicePool(*(self.rngs + other.rngs), self.mod + other.mod)
 
     def __sub__(self, other: Union[Dice, int]) -> DicePool:
         if isinstance(other, int):
-            return DicePool(*self.rngs, self.mod - other)
+            return self._shift(-other)
         if isinstance(other, Dice):
             rng, mod = normalize_rng(other)
-            if rng in self.rngs:
+            if self._rng_counts[(rng.start, rng.stop)]:
                 rngs = list(self.rngs)
                 rngs.remove(rng)
-                return DicePool(*rngs, self.mod - mod)
+                if self._approx:
+                    return DicePool(*rngs, self.mod - mod)
+                # Take the dice out of the distribution rather than
+                # computing the remaining dice distribution again
+                pmf = _remove_die(self._counts, len(rng))
+                offset = self.min - rng.start - mod
+                dist = tuple(
+                    (offset + i, int(chances)) for i, chances in enumerate(pmf)
+                )
+                return DicePool._from_dist(tuple(rngs), self.mod - mod, dist)
             raise ValueError(f"This range does not contain a {str(other)}")
         return NotImplemented
 
-    def _chances(self, threshold: int, comparator: Callable) -> float:
+    def _chances_below(self, threshold: int, inclusive: bool) -> int:
         """
-        Comparator should be a lambda such as `lambda a, b: a > b`
+        Return the number of combinations of this dice pool giving a result
+        lower than (or equal to, if `inclusive`) the threshold.
 
-        Return the rate with which this dice pool compare its possible
-        results with the threshold favorably.
-
-        Result is 1.0 >= rate >= 0.0, multiply it by 100 get percents.
+        Binary search the threshold in the cumulated distribution instead of
+        walking the whole distribution.
 
         """
-        total_chances = sum(self.dist.values())
-        chances_to_pass = sum(
-            [
-                chances
-                for result, chances in self.dist.items()
-                if comparator(result, threshold)
-            ]
+        index = np.searchsorted(
+            self._keys, threshold, side="right" if inclusive else "left"
         )
-        return chances_to_pass / total_chances
+        return int(self._cdf[index - 1]) if index else 0
 
     def show(self) -> None:
         """
@@ -316,10 +530,7 @@ class DicePool:
         """
         Return the dice pool average number.
         """
-        return float(
-            sum([key * value for key, value in self.dist.items()])
-            / sum(self.dist.values())
-        )
+        return float(self._weighted_sum / self._total)
 
     def rgt(self, threshold: int) -> float:
         """
@@ -329,7 +540,7 @@ class DicePool:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a > b)
+        return (self._total - self._chances_below(threshold, True)) / self._total
 
     def rge(self, threshold: int) -> float:
         """
@@ -339,7 +550,7 @@ class DicePool:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a >= b)
+        return (self._total - self._chances_below(threshold, False)) / self._total
 
     def rlt(self, threshold: int) -> float:
         """
@@ -349,7 +560,7 @@ class DicePool:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a < b)
+        return self._chances_below(threshold, False) / self._total
 
     def rle(self, threshold: int) -> float:
         """
@@ -359,10 +570,77 @@ class DicePool:
         """
         if not isinstance(threshold, int):
             raise NotImplementedError("Only supports int for now")
-        return self._chances(threshold, lambda a, b: a <= b)
+        return self._chances_below(threshold, True) / self._total
 
     def roll(self):
         """
         Roll the dice pool, get its result.
         """
-        return sum(random.choice(rng) for rng in self.rngs) + self.mod
+        return int(np.random.randint(self._starts, self._stops).sum()) + self.mod
+
+    def _combination_at(self, index: int) -> Tuple[int, ...]:
+        """
+        Return the dice results of the _index_ieme combination of this
+        dice pool, in the order `itertools.product(*self.rngs)` would
+        yield them, without enumerating the previous combinations.
+
+        Useful for reproducible sampling: draw an index between 0 and the
+        number of combinations instead of rolling the dice.
+
+        """
+        # Not self._total, which only counts the samples of approximated pools
+        combinations = reduce(mul, (len(rng) for rng in self.rngs), 1)
+        if not 0 <= index < combinations:
+            raise IndexError("Combination index out of range")
+        results = []
+        for rng in reversed(self.rngs):
+            index, face = divmod(index, len(rng))
+            results.append(rng[face])
+        return tuple(reversed(results))
+
+
+def probability_gt(threshold: int, *args) -> float:
+    """
+    Return the chances of the dice pool built from _args_ having a roll
+    greater than the threshold, same as `DicePool(*args).rgt(threshold)`.
+
+    Made for one-shot queries: the full distribution is never built.
+    While convolving the dice, results that can no longer end up above the
+    threshold are dropped and results that are already certain to end up
+    above it are counted, so only a window around the threshold is kept.
+
+    Pools over `DICEPOOL_EXACT_LIMIT` are approximated the same way
+    DicePool does it, from `DICEPOOL_SAMPLES` rolls, so the result is an
+    estimate that varies from one call to another.
+
+    """
+    if not isinstance(threshold, int):
+        raise NotImplementedError("Only supports int for now")
+    rngs, mod = _parse_pool_args(args)
+    if _needs_approx(tuple((rng.start, rng.stop) for rng in rngs)):
+        return DicePool(*rngs, mod).rgt(threshold)
+    threshold -= mod
+
+    # Bounds and number of outcomes of the dice left to convolve,
+    # suffixes[i] being about rngs[i:]
+    suffixes = [(0, 0, 1)]
+    for rng in reversed(rngs):
+        low, high, outcomes = suffixes[-1]
+        suffixes.append((low + rng.start, high + rng.stop - 1, outcomes * len(rng)))
+    suffixes.reverse()
+
+    total = suffixes[0][2]
+    dtype = np.int64 if total <= INT64_MAX else object
+    pmf, low, passed = np.ones(1, dtype=dtype), 0, 0
+    for i in range(len(rngs) + 1):
+        if i:
+            pmf = _add_die(pmf, len(rngs[i - 1]))
+            low += rngs[i - 1].start
+        remaining_low, remaining_high, remaining_outcomes = suffixes[i]
+        hopeless = max(0, min(len(pmf), threshold - remaining_high - low + 1))
+        certain = max(0, min(len(pmf), threshold - remaining_low - low + 1))
+        passed += int(pmf[certain:].sum()) * remaining_outcomes
+        pmf, low = pmf[hopeless:certain], low + hopeless
+        if not len(pmf):
+            break
+    return passed / total
@@ -1,5 +1,11 @@
 """Game Design misc tools"""
 import math
+from typing import List
+
+import numpy as np
+
+# _SUPERIOR_PREFIX[n] is the sum of 1 / trrt(i) for i from 1 to n
+_SUPERIOR_PREFIX: List[float] = [0.0]
 
 
 def triangular(num: int) -> int:
@@ -8,7 +14,7 @@ def triangular(num: int) -> int:
     see https://en.wikipedia.org/wiki/Triangular_number
 
     """
-    return num * (num + 1) / 2
+    return num * (num + 1) // 2
 
 
 def trrt(num: int) -> float:
@@ -26,7 +32,22 @@ def superior_trrt(num: int, factor: float = 1.0) -> float:
     Grows a little faster than the triangular root but posess
     a very similar curve.
     """
-    return sum(factor / trrt(i + 1) for i in range(num))
+    if num <= 0:
+        return 0.0
+    _extend_prefix(num)
+    return factor * _SUPERIOR_PREFIX[num]
+
+
+def _extend_prefix(num: int) -> None:
+    """
+    Grow the superior triangular root prefix sums up to _num_
+    `1 / trrt(i)` being inlined as `2 / (sqrt(8 * i + 1) - 1)`
+    """
+    start = len(_SUPERIOR_PREFIX)
+    if num < start:
+        return
+    terms = 2.0 / (np.sqrt(8 * np.arange(start, num + 1) + 1) - 1)
+    _SUPERIOR_PREFIX.extend((_SUPERIOR_PREFIX[-1] + np.cumsum(terms)).tolist())
 
 
 def trrt_value(num: int) -> float: